@@ -4,13 +4,16 @@ import dataclasses
 import struct
 
 
-def ddp_checksum(data):
-  '''Calculate the checksum used in DDP header as well as in determining multicast addresses.'''
-  retval = 0
+def _ddp_checksum_feed(retval, data):
   for byte in data:
     retval += byte
     retval = (retval & 0x7FFF) << 1 | (1 if retval & 0x8000 else 0)
-  return retval or 0xFFFF  # because a zero value in the checksum field means one was not calculated
+  return retval
+
+
+def ddp_checksum(data):
+  '''Calculate the checksum used in DDP header as well as in determining multicast addresses.'''
+  return _ddp_checksum_feed(0, data) or 0xFFFF  # because a zero value in the checksum field means one was not calculated
 
 
 @dataclasses.dataclass
@@ -19,6 +22,10 @@ class Datagram:
   
   MAX_DATA_LENGTH = 586
   
+  # no per-instance __dict__; spelled out rather than using dataclass(slots=True) so Python versions before 3.10 still work
+  __slots__ = ('hop_count', 'destination_network', 'source_network', 'destination_node', 'source_node', 'destination_socket',
+               'source_socket', 'ddp_type', 'data')
+  
   hop_count: int
   destination_network: int
   source_network: int
@@ -104,13 +111,13 @@ class Datagram:
                          self.destination_socket,
                          self.source_socket,
                          self.ddp_type)
-    data = header + self.data
-    length = 4 + len(data)
-    header = struct.pack('>BBH',
-                         (self.hop_count & 0xF) << 2 | (length & 0x300) >> 8,
-                         length & 0xFF,
-                         ddp_checksum(data) if calculate_checksum else 0x0000)
-    return header + data
+    length = 13 + len(self.data)
+    # the checksum covers everything after the hop count/length and checksum fields, so it runs over the header then the data
+    # and the data only gets copied once, into the returned bytes
+    checksum = (_ddp_checksum_feed(_ddp_checksum_feed(0, header), self.data) or 0xFFFF) if calculate_checksum else 0x0000
+    return b''.join((struct.pack('>BBH', (self.hop_count & 0xF) << 2 | (length & 0x300) >> 8, length & 0xFF, checksum),
+                     header,
+                     self.data))
   
   def as_short_header_bytes(self):
     '''Return this Datagram in short-header format as bytes and raise ValueErrors if there are issues.'''
@@ -135,3 +142,8 @@ class Datagram:
   def hop(self):
     '''Return a copy of this Datagram with the hop count incremented by one.'''
     return self.copy(hop_count=self.hop_count + 1)
+  
+  def hop_in_place(self):
+    '''Increment the hop count of this Datagram by one and return it; only for use when nothing else holds a reference to it.'''
+    self.hop_count += 1
+    return self
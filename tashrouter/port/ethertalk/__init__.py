@@ -154,9 +154,7 @@ class EtherTalkPort(Port):
     datagrams_to_send = deque()
     with self._tables_lock:
       self._address_mapping_table[(network, node)] = (mapped_hw_addr, time.monotonic())
-      if (network, node) in self._held_datagrams:
-        for datagram, _ in self._held_datagrams[(network, node)]: datagrams_to_send.append((mapped_hw_addr, datagram))
-        self._held_datagrams.pop((network, node))
+      for datagram, _ in self._held_datagrams.pop((network, node), ()): datagrams_to_send.append((mapped_hw_addr, datagram))
     for hw_addr, datagram in datagrams_to_send: self._send_datagram(hw_addr, datagram)
   
   def _send_aarp_requests_run(self):
@@ -298,11 +296,12 @@ class EtherTalkPort(Port):
     send_datagram = None
     send_aarp_request = None
     with self._tables_lock:
-      if (network, node) in self._address_mapping_table:
-        hw_addr, _ = self._address_mapping_table[(network, node)]
+      mapping = self._address_mapping_table.get((network, node))
+      if mapping:
+        hw_addr, _ = mapping
         send_datagram = (hw_addr, datagram)
-      elif (network, node) in self._held_datagrams:
-        self._held_datagrams[(network, node)].append((datagram, time.monotonic()))
+      elif (held_datagrams := self._held_datagrams.get((network, node))) is not None:
+        held_datagrams.append((datagram, time.monotonic()))
       else:
         self._held_datagrams[(network, node)] = deque(((datagram, time.monotonic()),))
         send_aarp_request = (network, node)
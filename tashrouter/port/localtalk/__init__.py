@@ -1,5 +1,7 @@
 '''Superclass for LocalTalk Ports.'''
 
+from array import array
+from binascii import crc_hqx
 import logging
 import random
 import struct
@@ -10,10 +12,13 @@ from ...datagram import Datagram
 from ...netlog import log_datagram_inbound, log_datagram_unicast, log_datagram_broadcast, log_datagram_multicast
 
 
+LLAP_HEADER = struct.Struct('>BBB')  # destination node, source node, LLAP type
+
+
 class FcsCalculator:
   '''Utility class to calculate the FCS (frame check sequence) of an LLAP frame.'''
   
-  LLAP_FCS_LUT = (
+  LLAP_FCS_LUT = array('H', (
     0x0000, 0x1189, 0x2312, 0x329B, 0x4624, 0x57AD, 0x6536, 0x74BF, 0x8C48, 0x9DC1, 0xAF5A, 0xBED3, 0xCA6C, 0xDBE5, 0xE97E, 0xF8F7,
     0x1081, 0x0108, 0x3393, 0x221A, 0x56A5, 0x472C, 0x75B7, 0x643E, 0x9CC9, 0x8D40, 0xBFDB, 0xAE52, 0xDAED, 0xCB64, 0xF9FF, 0xE876,
     0x2102, 0x308B, 0x0210, 0x1399, 0x6726, 0x76AF, 0x4434, 0x55BD, 0xAD4A, 0xBCC3, 0x8E58, 0x9FD1, 0xEB6E, 0xFAE7, 0xC87C, 0xD9F5,
@@ -30,7 +35,10 @@ class FcsCalculator:
     0xD68D, 0xC704, 0xF59F, 0xE416, 0x90A9, 0x8120, 0xB3BB, 0xA232, 0x5AC5, 0x4B4C, 0x79D7, 0x685E, 0x1CE1, 0x0D68, 0x3FF3, 0x2E7A,
     0xE70E, 0xF687, 0xC41C, 0xD595, 0xA12A, 0xB0A3, 0x8238, 0x93B1, 0x6B46, 0x7ACF, 0x4854, 0x59DD, 0x2D62, 0x3CEB, 0x0E70, 0x1FF9,
     0xF78F, 0xE606, 0xD49D, 0xC514, 0xB1AB, 0xA022, 0x92B9, 0x8330, 0x7BC7, 0x6A4E, 0x58D5, 0x495C, 0x3DE3, 0x2C6A, 0x1EF1, 0x0F78,
-  )
+  ))
+  
+  # crc_hqx computes the same CRC-CCITT but MSB-first, so bit-reverse its inputs and output to get the LSB-first LLAP FCS
+  BIT_REVERSE = bytes(int('{:08b}'.format(byte)[::-1], 2) for byte in range(256))
   
   def __init__(self):
     self.reg = 0
@@ -47,7 +55,9 @@ class FcsCalculator:
   
   def feed(self, data):
     '''Feed a bytes-like object into the FCS calculator.'''
-    for byte in data: self.feed_byte(byte)
+    rev = self.BIT_REVERSE
+    reg = crc_hqx(bytes(data).translate(rev), rev[self.reg & 0xFF] << 8 | rev[self.reg >> 8])
+    self.reg = rev[reg & 0xFF] << 8 | rev[reg >> 8]
   
   def byte1(self):
     '''Returns the first byte of the FCS.'''
@@ -108,7 +118,7 @@ class LocalTalkPort(Port):
   def inbound_frame(self, frame_data):
     '''Called by subclass when an inbound LocalTalk frame is received.'''
     if len(frame_data) < 3: return  # invalid frame, too short
-    destination_node, source_node, llap_type = struct.unpack('>BBB', frame_data[0:3])
+    destination_node, source_node, llap_type = LLAP_HEADER.unpack_from(frame_data)
     # short-header data frame
     if llap_type == self.LLAP_APPLETALK_SHORT_HEADER:
       try:
@@ -129,7 +139,7 @@ class LocalTalkPort(Port):
         self._router.inbound(datagram, self)
     # we've settled on a node address and someone else is asking if they can use it, we say no
     elif llap_type == self.LLAP_ENQ and self._respond_to_enq and self.node and self.node == destination_node:
-      self.send_frame(bytes((self.node, self.node, self.LLAP_ACK)))
+      self.send_frame(LLAP_HEADER.pack(self.node, self.node, self.LLAP_ACK))
     else:
       with self._node_lock:
         # someone else has responded that they're on the node address that we want
@@ -153,20 +163,20 @@ class LocalTalkPort(Port):
     if self.node == 0: return
     log_datagram_unicast(network, node, datagram, self)
     if datagram.destination_network == datagram.source_network and datagram.destination_network in (0, self.network):
-      self.send_frame(bytes((node, self.node, self.LLAP_APPLETALK_SHORT_HEADER)) + datagram.as_short_header_bytes())
+      self.send_frame(LLAP_HEADER.pack(node, self.node, self.LLAP_APPLETALK_SHORT_HEADER) + datagram.as_short_header_bytes())
     else:
-      self.send_frame(bytes((node, self.node, self.LLAP_APPLETALK_LONG_HEADER))
+      self.send_frame(LLAP_HEADER.pack(node, self.node, self.LLAP_APPLETALK_LONG_HEADER)
                       + datagram.as_long_header_bytes(calculate_checksum=self._calculate_checksums))
   
   def broadcast(self, datagram):
     if self.node == 0: return
     log_datagram_broadcast(datagram, self)
-    self.send_frame(bytes((0xFF, self.node, self.LLAP_APPLETALK_SHORT_HEADER)) + datagram.as_short_header_bytes())
+    self.send_frame(LLAP_HEADER.pack(0xFF, self.node, self.LLAP_APPLETALK_SHORT_HEADER) + datagram.as_short_header_bytes())
   
   def multicast(self, zone_name, datagram):
     if self.node == 0: return
     log_datagram_multicast(zone_name, datagram, self)
-    self.send_frame(bytes((0xFF, self.node, self.LLAP_APPLETALK_SHORT_HEADER)) + datagram.as_short_header_bytes())
+    self.send_frame(LLAP_HEADER.pack(0xFF, self.node, self.LLAP_APPLETALK_SHORT_HEADER) + datagram.as_short_header_bytes())
   
   def _set_network(self, network):
     logging.info('%s assigned network number %d', str(self), network)
@@ -197,5 +207,5 @@ class LocalTalkPort(Port):
         else:
           send_enq = self._desired_node
           self._desired_node_attempts += 1
-      if send_enq: self.send_frame(bytes((send_enq, send_enq, self.LLAP_ENQ)))
+      if send_enq: self.send_frame(LLAP_HEADER.pack(send_enq, send_enq, self.LLAP_ENQ))
     self._node_stopped_event.set()
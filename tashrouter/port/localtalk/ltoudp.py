@@ -29,6 +29,7 @@ class LtoudpPort(LocalTalkPort):
     self._intf_address = intf_address
     self._socket = None
     self._sender_id = None
+    self._sendmsg = None
     self._thread = None
     self._started_event = Event()
     self._stop_requested = False
@@ -59,6 +60,7 @@ class LtoudpPort(LocalTalkPort):
         if e.errno != errno.ENODEV or attempt + 1 == self.NETWORK_UP_RETRY_COUNT: raise
         time.sleep(self.NETWORK_UP_RETRY_TIMEOUT)
     self._sender_id = struct.pack('>L', os.getpid())
+    self._sendmsg = getattr(self._socket, 'sendmsg', None)  # not available on Windows
     super().start(router)
     self._thread = Thread(target=self._run)
     self._thread.start()
@@ -71,7 +73,10 @@ class LtoudpPort(LocalTalkPort):
   
   def send_frame(self, frame_data):
     log_localtalk_frame_outbound(frame_data, self)
-    self._socket.sendto(self._sender_id + frame_data, (self.LTOUDP_GROUP, self.LTOUDP_PORT))
+    if self._sendmsg:  # gather the sender ID and frame in the kernel rather than concatenating them
+      self._sendmsg((self._sender_id, frame_data), (), 0, (self.LTOUDP_GROUP, self.LTOUDP_PORT))
+    else:
+      self._socket.sendto(b''.join((self._sender_id, frame_data)), (self.LTOUDP_GROUP, self.LTOUDP_PORT))
   
   def _run(self):
     self._started_event.set()
@@ -1,7 +1,7 @@
 '''Port that connects to LocalTalk via TashTalk on a serial port.'''
 
 from queue import Queue, Empty
-from threading import Thread, Event
+from threading import Thread, Event, local
 
 import serial
 
@@ -9,6 +9,54 @@ from . import LocalTalkPort, FcsCalculator
 from ...netlog import log_localtalk_frame_inbound, log_localtalk_frame_outbound
 
 
+class TashTalkFramer:
+  '''Utility class to extract LocalTalk frames from the escaped byte stream that TashTalk sends over the serial port.'''
+  
+  def __init__(self):
+    self._fcs = FcsCalculator()
+    self._buf = bytearray(605)
+    self._buf_ptr = 0
+    self._escaped = False
+  
+  def feed(self, data):
+    '''Feed a bytes-like object read from TashTalk into the framer, return a list of frames completed by it that passed FCS.'''
+    frames = []
+    fcs = self._fcs
+    buf = self._buf
+    buf_ptr = self._buf_ptr
+    escaped = self._escaped
+    start = 0
+    end = len(data)
+    while start < end:
+      if escaped:
+        escaped = False
+        byte = data[start]
+        start += 1
+        if byte != 0xFF:
+          if byte == 0xFD and fcs.is_okay() and buf_ptr >= 5: frames.append(bytes(buf[:buf_ptr - 2]))
+          fcs.reset()
+          buf_ptr = 0
+          continue
+        run = b'\x00'  # 0x00 0xFF is a literal 0x00 byte
+      else:
+        # copy and FCS the whole literal run up to the next escape at once rather than byte by byte
+        escape = data.find(0x00, start)
+        if escape == -1:
+          escape = end
+        else:
+          escaped = True
+        run = data[start:escape]
+        start = escape + 1
+      run = run[:len(buf) - buf_ptr]
+      if run:
+        fcs.feed(run)
+        buf[buf_ptr:buf_ptr + len(run)] = run
+        buf_ptr += len(run)
+    self._buf_ptr = buf_ptr
+    self._escaped = escaped
+    return frames
+
+
 class TashTalkPort(LocalTalkPort):
   '''Port that connects to LocalTalk via TashTalk on a serial port.'''
   
@@ -27,6 +75,7 @@ class TashTalkPort(LocalTalkPort):
     self._writer_queue = Queue()
     self._writer_stop_flag = object()
     self._writer_stopped_event = Event()
+    self._send_fcs = local()  # send_frame is called from many threads, each gets its own FcsCalculator
   
   def short_str(self):
     return self._serial_port[5:] if self._serial_port.startswith('/dev/') else self._serial_port
@@ -56,7 +105,11 @@ class TashTalkPort(LocalTalkPort):
     self._writer_stopped_event.wait()
   
   def send_frame(self, frame_data):
-    fcs = FcsCalculator()
+    try:
+      fcs = self._send_fcs.calculator
+    except AttributeError:
+      fcs = self._send_fcs.calculator = FcsCalculator()
+    fcs.reset()
     fcs.feed(frame_data)
     log_localtalk_frame_outbound(frame_data, self)
     self._writer_queue.put(b''.join((b'\x01', frame_data, bytes((fcs.byte1(), fcs.byte2())))))
@@ -76,31 +129,11 @@ class TashTalkPort(LocalTalkPort):
   
   def _reader_run(self):
     self._reader_started_event.set()
-    fcs = FcsCalculator()
-    buf = bytearray(605)
-    buf_ptr = 0
-    escaped = False
+    framer = TashTalkFramer()
     while not self._reader_stop_requested:
-      for byte in self._serial_obj.read(self._serial_obj.in_waiting or 1):
-        if not escaped and byte == 0x00:
-          escaped = True
-          continue
-        elif escaped:
-          escaped = False
-          if byte == 0xFF:  # literal 0x00 byte
-            byte = 0x00
-          else:
-            if byte == 0xFD and fcs.is_okay() and buf_ptr >= 5:
-              data = bytes(buf[:buf_ptr - 2])
-              log_localtalk_frame_inbound(data, self)
-              self.inbound_frame(data)
-            fcs.reset()
-            buf_ptr = 0
-            continue
-        if buf_ptr < len(buf):
-          fcs.feed_byte(byte)
-          buf[buf_ptr] = byte
-          buf_ptr += 1
+      for frame_data in framer.feed(self._serial_obj.read(self._serial_obj.in_waiting or 1)):
+        log_localtalk_frame_inbound(frame_data, self)
+        self.inbound_frame(frame_data)
     self._reader_stopped_event.set()
   
   def _writer_run(self):
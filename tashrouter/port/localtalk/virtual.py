@@ -52,7 +52,12 @@ class VirtualLocalTalkNetwork:
     with self._lock: self._plugged.remove(recv_func)
   
   def send_frame(self, frame_data, recv_func):
-    '''Send a LocalTalk frame to all ports plugged into this network.'''
+    '''Send a LocalTalk frame to all ports plugged into this network.
+    
+    The same immutable bytes object is handed to every receiver, so a mutable bytes-like is converted once here rather than
+    receivers each taking their own copy.
+    '''
+    if not isinstance(frame_data, bytes): frame_data = bytes(frame_data)
     functions_to_call = deque()
     with self._lock:
       for func in self._plugged:
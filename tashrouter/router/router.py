@@ -1,8 +1,10 @@
 '''The heart of this whole affair.'''
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 from .routing_table import RoutingTable
+from .versioned_cache import VersionedCache
 from .zone_information_table import ZoneInformationTable
 from ..datagram import Datagram
 from ..service.echo import EchoService
@@ -17,6 +19,8 @@ from ..service.zip.sending import ZipSendingService
 class Router:
   '''A router, a device which sends Datagrams to Ports and runs Services.'''
   
+  ROUTE_CACHE_SIZE = 256
+  
   def __init__(self, short_str, ports):
     self._short_str = short_str
     self.ports = ports
@@ -33,7 +37,10 @@ class Router:
     self._services_by_sas = {}
     for sas, service in self._services:
       if sas is not None: self._services_by_sas[sas] = service
+    self._service_by_sas = self._services_by_sas.get  # services never change after this, so bind the lookup once
     self.routing_table = RoutingTable(self)
+    self._get_by_network = self.routing_table.get_by_network
+    self._route_cache = VersionedCache(self.ROUTE_CACHE_SIZE)  # network -> (entry, is_bad), keyed on RoutingTable version
   
   def short_str(self):
     '''Return a short string representation of this Router.'''
@@ -42,67 +49,78 @@ class Router:
   __str__ = short_str
   __repr__ = short_str
   
+  def _get_route(self, network):
+    '''Look up a network in the RoutingTable, caching the result for as long as the RoutingTable stays unchanged.'''
+    return self._route_cache.get(self.routing_table.version, network, self._get_by_network)
+  
   def _deliver(self, datagram, rx_port):
     '''Deliver a datagram locally to the "control plane" of the router.'''
-    if service := self._services_by_sas.get(datagram.destination_socket): service.inbound(datagram, rx_port)
+    if service := self._service_by_sas(datagram.destination_socket): service.inbound(datagram, rx_port)
+  
+  @staticmethod
+  def _in_parallel(verb, func, things):
+    '''Call func on each of things at once; starting and stopping Services and stopping Ports is mostly waiting on threads.'''
+    def run(thing):
+      logging.info('%s %s...', verb, str(thing.__class__.__name__))
+      func(thing)
+    with ThreadPoolExecutor(max_workers=len(things) or 1) as executor: tuple(executor.map(run, things))
   
   def start(self):
     '''Start this router.'''
-    # Ports are responsible for adding their seed entries to routing_table
+    # Ports are responsible for adding their seed entries to routing_table; they're started one at a time, in order, so that if two
+    # Ports' seed ranges conflict, it's always the same one that wins
     for port in self.ports:
       logging.info('starting %s...', str(port.__class__.__name__))
       port.start(self)
     logging.info('all ports started!')
-    for _, service in self._services:
-      logging.info('starting %s...', str(service.__class__.__name__))
-      service.start(self)
+    self._in_parallel('starting', lambda service: service.start(self), tuple(service for _, service in self._services))
     logging.info('all services started!')
   
   def stop(self):
     '''Stop this router.'''
-    for _, service in self._services:
-      logging.info('stopping %s...', str(service.__class__.__name__))
-      service.stop()
+    self._in_parallel('stopping', lambda service: service.stop(), tuple(service for _, service in self._services))
     logging.info('all services stopped!')
-    for port in self.ports:
-      logging.info('stopping %s...', str(port.__class__.__name__))
-      port.stop()
+    self._in_parallel('stopping', lambda port: port.stop(), self.ports)
     logging.info('all ports stopped!')
   
   def inbound(self, datagram, rx_port):
-    '''Called by a Port when a Datagram comes in from that port.  The Datagram may be routed, delivered, both, or neither.'''
+    '''Called by a Port when a Datagram comes in from that port.  The Datagram may be routed, delivered, both, or neither.
+    
+    The Router takes ownership of the Datagram and may modify it; the Port must not use it afterward.
+    '''
     
     # a network number of zero means "this network", but we know what that is from the port, so sub it in
     # note that short-header Datagrams always have a network number of zero
     if rx_port.network:
-      if datagram.destination_network == datagram.source_network == 0x0000:
-        datagram = datagram.copy(destination_network=rx_port.network, source_network=rx_port.network)
-      elif datagram.destination_network == 0x0000:
-        datagram = datagram.copy(destination_network=rx_port.network)
-      elif datagram.source_network == 0x0000:
-        datagram = datagram.copy(source_network=rx_port.network)
+      if datagram.destination_network == 0x0000: datagram.destination_network = rx_port.network
+      if datagram.source_network == 0x0000: datagram.source_network = rx_port.network
+    
+    # these are tested with plain comparisons rather than by building a tuple to search on every Datagram
+    destination_network = datagram.destination_network
+    destination_node = datagram.destination_node
     
     # if this Datagram's destination network is this port's network, there is no need to route it
-    if datagram.destination_network in (0x0000, rx_port.network):
+    if destination_network == 0x0000 or destination_network == rx_port.network:
       # if Datagram is bound for the router via the any-router address, the broadcast address, or its own node address, deliver it
-      if datagram.destination_node in (0x00, rx_port.node, 0xFF):
+      if destination_node == 0x00 or destination_node == 0xFF or destination_node == rx_port.node:
         self._deliver(datagram, rx_port)
       return
     
     # if this Datagram's destination network is one the router is connected to, we may need to deliver it
-    entry, _ = self.routing_table.get_by_network(datagram.destination_network)
+    entry, _ = self._get_route(destination_network)
     if entry is not None and entry.distance == 0:
       # if this Datagram is addressed to this router's address on another port, deliver and do not route
-      if datagram.destination_network == entry.port.network and datagram.destination_node == entry.port.node:
+      if destination_node == entry.port.node and destination_network == entry.port.network:
         self._deliver(datagram, rx_port)
         return
       # if this Datagram is bound for any router on a network to which this router is directly connected, deliver and do not route
-      elif datagram.destination_node == 0x00:
+      elif destination_node == 0x00:
         self._deliver(datagram, rx_port)
         return
       # if this Datagram is broadcast to this router's address on another port, deliver but also route
-      elif datagram.destination_node == 0xFF:
-        self._deliver(datagram, rx_port)
+      # (routing increments the hop count in place, so the control plane gets its own copy)
+      elif destination_node == 0xFF:
+        self._deliver(datagram.copy(), rx_port)
     
     self.route(datagram, originating=False)
   
@@ -115,68 +133,68 @@ class Router:
       if datagram.destination_network == 0x0000: raise ValueError('originated datagrams must have nonzero destination network')
       # we expect source_network will be zero and we'll fill it in once we know what port we're coming from
     
+    destination_network = datagram.destination_network
+    destination_node = datagram.destination_node
+    
     # if we still don't know where we're going, we obviously can't get there; discard the Datagram
-    if datagram.destination_network == 0x0000: return
+    if destination_network == 0x0000: return
     
     # if the hop count is too high, we can't increment it even if we'd otherwise send the Datagram on; discard the Datagram
     if datagram.hop_count >= 15: return
     
-    entry, _ = self.routing_table.get_by_network(datagram.destination_network)
+    entry, _ = self._get_route(destination_network)
     
     # you can't get there from here; discard the Datagram
     if entry is None: return
+    port = entry.port
     
     # if we're originating this datagram, we expect that its source network and node will be blank
     if originating:
       # if for some reason the port is in the routing table but doesn't yet have a network and node, discard the Datagram
-      if entry.port.network == 0x0000 or entry.port.node == 0x00: return
+      if port.network == 0x0000 or port.node == 0x00: return
       # else, fill in its source network and node with those of the port it's coming from
-      datagram = datagram.copy(source_network=entry.port.network, source_node=entry.port.node)
+      datagram = datagram.copy(source_network=port.network, source_node=port.node)
     else:
       # invalid values for source node, ports will refuse to send it on; discard the Datagram
       if datagram.source_node in (0x00, 0xFF): return
-      # we're not originating this datagram, so bump its hop count
-      datagram = datagram.hop()
+      # we're not originating this datagram, so bump its hop count; inbound is the only caller and has no further use for it
+      datagram.hop_in_place()
     
     # here isn't there but we know how to get there; send the Datagram to the next router
     if entry.distance != 0:
-      entry.port.unicast(entry.next_network, entry.next_node, datagram)
+      port.unicast(entry.next_network, entry.next_node, datagram)
     # special 'any router' address (see IA page 4-7), control plane's responsibility; discard the Datagram
-    elif datagram.destination_node == 0x00:
+    elif destination_node == 0x00:
       pass
     # addressed to another port of this router's, control plane's responsibility; discard the Datagram
-    elif datagram.destination_network == entry.port.network and datagram.destination_node == entry.port.node:
+    elif destination_node == port.node and destination_network == port.network:
       pass
     # the destination is a broadcast to a network to which we are directly connected; broadcast the Datagram there
-    elif datagram.destination_node == 0xFF:
-      entry.port.broadcast(datagram)
+    elif destination_node == 0xFF:
+      port.broadcast(datagram)
     # the destination is connected to us directly; send the Datagram to its final destination
     else:
-      entry.port.unicast(datagram.destination_network, datagram.destination_node, datagram)
+      port.unicast(destination_network, destination_node, datagram)
   
   def reply(self, datagram, rx_port, ddp_type, data):
     '''Build and send a reply Datagram to the given Datagram coming in over the given Port with the given data.'''
     
-    if datagram.source_node in (0x00, 0xFF):
-      pass  # invalid as source, don't reply
-    elif rx_port.node and (datagram.source_network == 0x0000 or 0xFF00 <= datagram.source_network <= 0xFFFE or
-                           datagram.source_network < rx_port.network_min or datagram.source_network > rx_port.network_max):
-      rx_port.broadcast(Datagram(hop_count=0,
-                                 destination_network=0x0000,
-                                 source_network=rx_port.network,
-                                 destination_node=0xFF,
-                                 source_node=rx_port.node,
-                                 destination_socket=datagram.source_socket,
-                                 source_socket=datagram.destination_socket,
-                                 ddp_type=ddp_type,
-                                 data=data))
+    if datagram.source_node in (0x00, 0xFF): return  # invalid as source, don't reply
+    
+    # if the source is not reachable through rx_port's network range, broadcast the reply on rx_port, else route it back
+    source_network = datagram.source_network
+    broadcast = rx_port.node and (source_network == 0x0000 or 0xFF00 <= source_network <= 0xFFFE or
+                                  not rx_port.network_min <= source_network <= rx_port.network_max)
+    reply_datagram = Datagram(hop_count=0,
+                              destination_network=0x0000 if broadcast else source_network,
+                              source_network=rx_port.network if broadcast else 0,  # route will fill this in
+                              destination_node=0xFF if broadcast else datagram.source_node,
+                              source_node=rx_port.node if broadcast else 0,  # route will fill this in
+                              destination_socket=datagram.source_socket,
+                              source_socket=datagram.destination_socket,
+                              ddp_type=ddp_type,
+                              data=data)
+    if broadcast:
+      rx_port.broadcast(reply_datagram)
     else:
-      self.route(Datagram(hop_count=0,
-                          destination_network=datagram.source_network,
-                          source_network=0,  # route will fill this in
-                          destination_node=datagram.source_node,
-                          source_node=0,  # route will fill this in
-                          destination_socket=datagram.source_socket,
-                          source_socket=datagram.destination_socket,
-                          ddp_type=ddp_type,
-                          data=data))
+      self.route(reply_datagram)
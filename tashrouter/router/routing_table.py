@@ -1,7 +1,7 @@
 '''Table of routing information.'''
 
+from bisect import bisect_left, bisect_right
 import dataclasses
-from collections import deque
 import logging
 from threading import Lock
 
@@ -28,55 +28,138 @@ class RoutingTable:
   STATE_SUS = 2
   STATE_BAD = 3
   STATE_WORST = 4
+  BAD_STATES = frozenset((STATE_BAD, STATE_WORST))
   
   def __init__(self, router):
     self._router = router
-    self._entry_by_network = {}
-    self._state_by_entry = {}
+    # (sorted network_min of every entry, entries in the same order); ranges never overlap
+    # this is replaced rather than modified so get_by_network can read it without taking the lock
+    self._ranges = ((), ())
+    # rather than keeping a state per entry and stepping every one of them on every aging, keep the aging tick at which each entry
+    # was last refreshed (None for directly-connected entries, which only age once marked bad) and derive states from that, so
+    # aging only has to visit the entries that age out
+    self._tick = 0
+    self._stamp_by_entry = {}
+    self._entries_by_stamp = {}  # stamp -> dict of entries with that stamp, used as an ordered set
     self._lock = Lock()
+    self.version = 0  # incremented after every change to the table, see VersionedCache for how caches use it
   
   def __contains__(self, entry):
     with self._lock:
-      return True if entry in self._state_by_entry else False
+      return True if entry in self._stamp_by_entry else False
   
   def __iter__(self):
     with self._lock:
-      retval = deque(self._state_by_entry.keys())
+      retval = tuple(self._stamp_by_entry.keys())
     yield from retval
   
+  def _add(self, entry):
+    starts, entries = self._ranges
+    i = bisect_right(starts, entry.network_min)
+    self._ranges = (starts[:i] + (entry.network_min,) + starts[i:], entries[:i] + (entry,) + entries[i:])
+  
+  def _replace(self, old_entry, new_entry):
+    '''Put new_entry in old_entry's place in the ranges in a single swap; new_entry's range must be within old_entry's.'''
+    starts, entries = self._ranges
+    i = bisect_left(starts, old_entry.network_min)
+    self._ranges = (starts[:i] + (new_entry.network_min,) + starts[i + 1:], entries[:i] + (new_entry,) + entries[i + 1:])
+  
+  def _prune(self):
+    '''Drop entries that are no longer in _stamp_by_entry from the ranges, all at once.'''
+    entries = tuple(entry for entry in self._ranges[1] if entry in self._stamp_by_entry)
+    self._ranges = (tuple(entry.network_min for entry in entries), entries)
+  
+  def _state(self, stamp):
+    return self.STATE_GOOD if stamp is None else self.STATE_GOOD + self._tick - stamp
+  
+  def _stamp(self, entry, stamp):
+    '''Set the tick at which an entry was last refreshed, or None if it doesn't age.'''
+    old_stamp = self._stamp_by_entry.get(entry)
+    if old_stamp is not None: self._entries_by_stamp[old_stamp].pop(entry)
+    self._stamp_by_entry[entry] = stamp
+    if stamp is not None: self._entries_by_stamp.setdefault(stamp, {})[entry] = None
+  
+  def _unstamp(self, entry):
+    '''Forget an entry's stamp, returning True if the entry was in the table.'''
+    try:
+      stamp = self._stamp_by_entry.pop(entry)
+    except KeyError:
+      return False
+    if stamp is not None: self._entries_by_stamp[stamp].pop(entry)
+    return True
+  
+  def _fresh_stamp(self, entry):
+    return None if entry.distance == 0 else self._tick
+  
+  def _overlapping(self, network_min, network_max):
+    '''Return a list of the entries whose ranges overlap the given range, highest range first.'''
+    starts, entries = self._ranges
+    retval = []
+    i = bisect_right(starts, network_max) - 1
+    while i >= 0:
+      entry = entries[i]
+      if entry.network_max < network_min: break
+      retval.append(entry)
+      i -= 1
+    return retval
+  
+  def _covering(self, network_min, network_max):
+    '''Return the entry whose range includes the whole of the given range, None if no entry overlaps it, or False if entries
+    overlap only part of it.'''
+    starts, entries = self._ranges
+    # ranges never overlap, so the entry starting closest below network_max is the only one that can cover the whole range
+    i = bisect_right(starts, network_max) - 1
+    if i < 0: return None
+    entry = entries[i]
+    if entry.network_max < network_min: return None
+    return entry if entry.network_min <= network_min and entry.network_max >= network_max else False
+  
   def get_by_network(self, network):
     '''Look up and return an entry in this RoutingTable by network number.  Returns (entry, is_bad).'''
-    with self._lock:
-      entry = self._entry_by_network.get(network)
-      if entry is None: return None, None
-      return entry, True if self._state_by_entry[entry] in (self.STATE_BAD, self.STATE_WORST) else False
+    # no lock needed: _ranges is swapped atomically, and writers stamp an entry before publishing it and unstamp it only after
+    # it's been swapped out, so an entry without a stamp was swapped out after we read _ranges (look again in the new one) or has
+    # aged out and is waiting to be pruned (it's gone)
+    for _ in range(2):
+      ranges = self._ranges
+      starts, entries = ranges
+      i = bisect_right(starts, network) - 1
+      entry = entries[i] if i >= 0 else None
+      if entry is None or entry.network_max < network: return (None, None)
+      try:
+        stamp = self._stamp_by_entry[entry]
+      except KeyError:
+        if self._ranges is ranges: return (None, None)
+        continue
+      return (entry, self._state(stamp) in self.BAD_STATES)
+    return (None, None)
   
   def mark_bad(self, network_min, network_max):
     '''If this RoutingTable has an entry with the given network range, mark it bad.  Return True if it existed, else False.'''
     with self._lock:
-      cur_entries = set(self._entry_by_network.get(network) for network in range(network_min, network_max + 1))
-      if len(cur_entries) != 1: return False
-      cur_entry = cur_entries.pop()  # this is either None or an entry with a coincident range to the new one
+      cur_entry = self._covering(network_min, network_max)
       if not cur_entry: return False
-      if self._state_by_entry[cur_entry] != self.STATE_WORST: self._state_by_entry[cur_entry] = self.STATE_BAD
+      if self._state(self._stamp_by_entry[cur_entry]) not in self.BAD_STATES:
+        self._stamp(cur_entry, self._tick - (self.STATE_BAD - self.STATE_GOOD))
+        self.version += 1
       return True
   
   def consider(self, entry):
     '''Consider a new entry for addition to the table.  Return True if added, False if not.'''
     
     with self._lock:
-      if entry in self._state_by_entry:
-        self._state_by_entry[entry] = self.STATE_GOOD
+      if entry in self._stamp_by_entry:
+        if self._state(self._stamp_by_entry[entry]) != self.STATE_GOOD:
+          self._stamp(entry, self._fresh_stamp(entry))
+          self.version += 1
         return True
-      cur_entries = set(self._entry_by_network.get(network) for network in range(entry.network_min, entry.network_max + 1))
-      if len(cur_entries) != 1: return False  # this network range overlaps one that's already defined, can't do anything with it
-      cur_entry = cur_entries.pop()
+      cur_entry = self._covering(entry.network_min, entry.network_max)
+      if cur_entry is False: return False  # this network range overlaps one that's already defined, can't do anything with it
       
       # range currently undefined, add new entry to the table
       if cur_entry is None:
         pass
       # range fully defined by an entry that is either bad or further away, add new entry to the table
-      elif cur_entry.distance >= entry.distance or self._state_by_entry[cur_entry] in (self.STATE_BAD, self.STATE_WORST):
+      elif cur_entry.distance >= entry.distance or self._state(self._stamp_by_entry[cur_entry]) in self.BAD_STATES:
         pass
       # range fully defined by an entry representing a route that is now further than we thought, add new entry to the table
       elif (cur_entry.next_network, cur_entry.next_node, cur_entry.port) == (entry.next_network, entry.next_node, entry.port):
@@ -85,58 +168,48 @@ class RoutingTable:
       else:
         return False
       
-      if cur_entry: self._state_by_entry.pop(cur_entry)
-      self._state_by_entry[entry] = self.STATE_GOOD
-      for network in range(entry.network_min, entry.network_max + 1): self._entry_by_network[network] = entry
+      # stamp the new entry before it's published and unstamp the old one only after it's been swapped out, so lock-free readers
+      # always find one or the other with a stamp
+      self._stamp(entry, self._fresh_stamp(entry))
+      if cur_entry:
+        self._replace(cur_entry, entry)
+        self._unstamp(cur_entry)
+      else:
+        self._add(entry)
+      self.version += 1
       logging.debug('%s adding: %s', str(self._router), str(entry))
       return True
   
   def age(self):
     '''Age the RoutingTableEntries in this RoutingTable.'''
-    entries_to_delete = set()
-    networks_to_delete = deque()
     with self._lock:
-      for entry in set(self._entry_by_network.values()):
-        if self._state_by_entry[entry] == self.STATE_WORST:
-          logging.debug('%s aging out: %s', str(self._router), str(entry))
-          entries_to_delete.add(entry)
-          self._state_by_entry.pop(entry)
-          try:
-            self._router.zone_information_table.remove_networks(entry.network_min, entry.network_max)
-          except ValueError as e:
-            logging.warning("%s couldn't remove networks from zone information table: %s", str(self._router), e.args[0])
-        elif self._state_by_entry[entry] == self.STATE_BAD:
-          self._state_by_entry[entry] = self.STATE_WORST
-        elif self._state_by_entry[entry] == self.STATE_SUS:
-          self._state_by_entry[entry] = self.STATE_BAD
-        elif self._state_by_entry[entry] == self.STATE_GOOD and entry.distance != 0:
-          self._state_by_entry[entry] = self.STATE_SUS
-      for network, entry in self._entry_by_network.items():
-        if entry in entries_to_delete: networks_to_delete.append(network)
-      for network in networks_to_delete: self._entry_by_network.pop(network)
+      aged_out = False
+      # every other entry moves on to its next state just by the tick advancing, so only the worst ones need visiting
+      for entry in self._entries_by_stamp.pop(self._tick - (self.STATE_WORST - self.STATE_GOOD), {}):
+        logging.debug('%s aging out: %s', str(self._router), str(entry))
+        self._stamp_by_entry.pop(entry)
+        aged_out = True
+        try:
+          self._router.zone_information_table.remove_networks(entry.network_min, entry.network_max)
+        except ValueError as e:
+          logging.warning("%s couldn't remove networks from zone information table: %s", str(self._router), e.args[0])
+      self._tick += 1
+      if aged_out: self._prune()
+      self.version += 1
   
   def entries(self):
     '''Yield entries from this RoutingTable along with their badness state.'''
-    with self._lock: retval = deque(self._state_by_entry.items())
-    for entry, state in retval: yield entry, True if state in (self.STATE_BAD, self.STATE_WORST) else False
+    bad_states = self.BAD_STATES
+    state = self._state
+    with self._lock: retval = tuple((entry, state(stamp) in bad_states) for entry, stamp in self._stamp_by_entry.items())
+    yield from retval
   
   def set_port_range(self, port, network_min, network_max):
     '''Set the network range for a given port, unsetting any previous entries in the table that defined it.'''
-    entries_to_delete = set()
-    networks_to_delete = deque()
     with self._lock:
-      for network, entry in self._entry_by_network.items():
-        if entry.port is port and entry.distance == 0:
-          entries_to_delete.add(entry)
-          networks_to_delete.append(network)
-      for entry in entries_to_delete:
-        logging.debug('%s deleting: %s', str(self._router), str(entry))
-        self._state_by_entry.pop(entry)
-        try:
-          self._router.zone_information_table.remove_networks(entry.network_min, entry.network_max)
-        except ValueError as e:
-          logging.warning("%s couldn't remove networks from zone information table: %s", str(self._router), e.args[0])
-      for network in networks_to_delete: self._entry_by_network.pop(network)
+      old_port_entries = [entry for entry in self._stamp_by_entry.keys() if entry.port is port and entry.distance == 0]
+      # the port's range takes precedence over any routes to it that we learned before it was set
+      overlapping_entries = self._overlapping(network_min, network_max)
       entry = RoutingTableEntry(extended_network=port.extended_network,
                                 network_min=network_min,
                                 network_max=network_max,
@@ -144,6 +217,25 @@ class RoutingTable:
                                 port=port,
                                 next_network=0,
                                 next_node=0)
+      # stamp the new entry, then publish the ranges without the entries it replaces and with it in one swap, then unstamp the
+      # replaced entries, so lock-free readers never see the port's networks go missing or the new entry without a stamp
+      removed = set(old_port_entries)
+      removed.update(overlapping_entries)
+      removed.add(entry)  # in case the port's range is being set to what it already was
+      self._stamp(entry, None)
+      entries = tuple(other_entry for other_entry in self._ranges[1] if other_entry not in removed)
+      starts = tuple(other_entry.network_min for other_entry in entries)
+      i = bisect_right(starts, network_min)
+      self._ranges = (starts[:i] + (network_min,) + starts[i:], entries[:i] + (entry,) + entries[i:])
+      for old_entry in old_port_entries:
+        logging.debug('%s deleting: %s', str(self._router), str(old_entry))
+        if old_entry != entry: self._unstamp(old_entry)
+        try:
+          self._router.zone_information_table.remove_networks(old_entry.network_min, old_entry.network_max)
+        except ValueError as e:
+          logging.warning("%s couldn't remove networks from zone information table: %s", str(self._router), e.args[0])
+      for old_entry in overlapping_entries:
+        if old_entry not in old_port_entries and old_entry != entry and self._unstamp(old_entry):
+          logging.debug('%s deleting: %s', str(self._router), str(old_entry))
       logging.debug('%s adding: %s', str(self._router), str(entry))
-      for network in range(network_min, network_max + 1): self._entry_by_network[network] = entry
-      self._state_by_entry[entry] = self.STATE_GOOD
+      self.version += 1
@@ -0,0 +1,25 @@
+'''Cache for lookups made against versioned tables.'''
+
+
+class VersionedCache:
+  '''A bounded cache of lookup results that are only good for as long as the table(s) they came from stay at the same version.
+  
+  RoutingTable and ZoneInformationTable increment their version after every change.  Callers must read the version before doing
+  the lookup it guards, so a change that races with the lookup can only leave a result labeled with a stale version (which is
+  discarded on the next call), never a stale result labeled with the current version.  The cache is replaced rather than cleared
+  when the version changes or it fills up, so threads can share it without a lock.
+  '''
+  
+  def __init__(self, size):
+    self.size = size
+    self._cache = (None, {})  # (version, key -> result)
+  
+  def get(self, version, key, lookup):
+    '''Return the result of lookup(key) cached at the given version, calling lookup and caching its result if there isn't one.'''
+    cache_version, cache = self._cache
+    if cache_version == version and (result := cache.get(key)) is not None: return result
+    if cache_version != version or len(cache) >= self.size:
+      cache = {}
+      self._cache = (version, cache)
+    result = cache[key] = lookup(key)
+    return result
@@ -1,6 +1,7 @@
 '''Zone Information Table (ZIT) class and associated things.'''
 
-from collections import deque
+from bisect import bisect_left, bisect_right
+from itertools import chain
 import logging
 from threading import Lock
 
@@ -9,17 +10,17 @@ ATALK_LCASE = b'abcdefghijklmnopqrstuvwxyz\x88\x8A\x8B\x8C\x8D\x8E\x96\x9A\x9B\x
 ATALK_UCASE = b'ABCDEFGHIJKLMNOPQRSTUVWXYZ\xCB\x80\xCC\x81\x82\x83\x84\x85\xCD\x86\xAE\xAF\xCE'
 
 
+ATALK_UCASE_TABLE = bytes(ATALK_UCASE[ATALK_LCASE.index(byte)] if byte in ATALK_LCASE else byte for byte in range(256))
+
+
 def ucase_char(byte):
   '''Convert a single byte to its uppercase representation using the correspondence table laid out in IA Appendix D.'''
-  try:
-    return ATALK_UCASE[ATALK_LCASE.index(byte)]
-  except ValueError:
-    return byte
+  return ATALK_UCASE_TABLE[byte]
 
 
 def ucase(b):
   '''Convert a bytes-like to uppercase using the correspondence table laid out in IA Appendix D.'''
-  return bytes(ucase_char(byte) for byte in b)
+  return bytes(b).translate(ATALK_UCASE_TABLE)
 
 
 class ZoneInformationTable:
@@ -27,15 +28,33 @@ class ZoneInformationTable:
   
   def __init__(self, router):
     self._router = router
-    self._network_min_to_network_max = {}
-    self._network_min_to_zone_name_set = {}
-    self._network_min_to_default_zone_name = {}
-    self._zone_name_to_network_min_set = {}
-    self._ucased_zone_name_to_zone_name = {}
+    # (sorted network_min of every range,
+    #  network_min -> (network_max, names of zones in range with the default zone first),
+    #  zone name -> frozenset of network_min of ranges in zone,
+    #  ucased zone name -> zone name)
+    # writers replace this under the lock rather than modifying it, so readers can use it without taking the lock
+    self._tables = ((), {}, {}, {})
+    self._zone_name_to_ucased_zone_name = {}  # saves re-ucasing zone names already in the table
     self._lock = Lock()
+    self.version = 0  # incremented after every change to the table, like RoutingTable.version
+  
+  def __len__(self):
+    return len(self._tables[2])
+  
+  def __contains__(self, zone_name):
+    return self._ucase(zone_name) in self._tables[3]
   
-  def _check_range(self, network_min, network_max=None):
-    looked_up_network_max = self._network_min_to_network_max.get(network_min)
+  def _ucase(self, zone_name):
+    # only bytes can be looked up in the cache, other bytes-likes (bytearray, memoryview) may be unhashable
+    if type(zone_name) is not bytes: return ucase(zone_name)
+    ucased_zone_name = self._zone_name_to_ucased_zone_name.get(zone_name)
+    return ucase(zone_name) if ucased_zone_name is None else ucased_zone_name
+  
+  @staticmethod
+  def _check_range(tables, network_min, network_max=None):
+    network_mins, ranges, _, _ = tables
+    looked_up_range = ranges.get(network_min)
+    looked_up_network_max = None if looked_up_range is None else looked_up_range[0]
     if network_max is None:
       if looked_up_network_max is None:
         raise ValueError('network range %d-? does not exist' % network_min)
@@ -45,9 +64,12 @@ class ZoneInformationTable:
       return network_max
     elif looked_up_network_max is not None:
       raise ValueError('network range %d-%d overlaps %d-%d' % (network_min, network_max, network_min, looked_up_network_max))
-    else:  # check for overlap
-      for existing_min, existing_max in self._network_min_to_network_max.items():
-        if existing_min > network_max or existing_max < network_min: continue
+    else:  # check for overlap; ranges never overlap each other, so only the lowest one that could overlap this one needs checking
+      i = bisect_right(network_mins, network_min) - 1
+      if i < 0 or ranges[network_mins[i]][0] < network_min: i += 1
+      if i < len(network_mins) and network_mins[i] <= network_max:
+        existing_min = network_mins[i]
+        existing_max = ranges[existing_min][0]
         raise ValueError('network range %d-%d overlaps %d-%d' % (network_min, network_max, existing_min, existing_max))
       return None
   
@@ -55,71 +77,110 @@ class ZoneInformationTable:
     '''Add a range of networks to a zone, adding the zone if it isn't in the table.'''
     
     if network_max and network_max < network_min: raise ValueError('range %d-%d is backwards' % (network_min, network_max))
-    ucased_zone_name = ucase(zone_name)
+    if type(zone_name) is not bytes: zone_name = bytes(zone_name)  # zone names are stored as dict keys, so they must be hashable
+    ucased_zone_name = self._ucase(zone_name)
+    
+    # zones are mostly re-added to ranges they're already in (ZIP replies to repeated queries), which changes nothing, so check for
+    # that in the snapshot without taking the lock, publishing new tables, or invalidating anything keyed on the version
+    _, ranges, _, zone_names_by_ucased = self._tables
+    looked_up_range = ranges.get(network_min)
+    if (looked_up_range is not None and (network_max is None or network_max == looked_up_range[0]) and
+        zone_names_by_ucased.get(ucased_zone_name) in looked_up_range[1]): return
     
     with self._lock:
       
-      if ucased_zone_name in self._ucased_zone_name_to_zone_name:
-        zone_name = self._ucased_zone_name_to_zone_name[ucased_zone_name]
+      network_mins, ranges, zone_network_mins, zone_names_by_ucased = self._tables
+      check_range = self._check_range(self._tables, network_min, network_max)
+      
+      existing_zone_name = zone_names_by_ucased.get(ucased_zone_name)
+      if existing_zone_name is not None:
+        zone_name = existing_zone_name
       else:
-        self._ucased_zone_name_to_zone_name[ucased_zone_name] = zone_name
-        self._zone_name_to_network_min_set[zone_name] = set()
+        zone_names_by_ucased = dict(zone_names_by_ucased)
+        zone_names_by_ucased[ucased_zone_name] = zone_name
+        self._zone_name_to_ucased_zone_name[zone_name] = ucased_zone_name
       
-      check_range = self._check_range(network_min, network_max)
       if check_range:
         network_max = check_range
-        self._network_min_to_zone_name_set[network_min].add(zone_name)
+        zone_names = ranges[network_min][1]
+        if zone_name not in zone_names: zone_names += (zone_name,)
         now_default = False
       else:
-        self._network_min_to_network_max[network_min] = network_max
-        self._network_min_to_zone_name_set[network_min] = set((zone_name,))
-        self._network_min_to_default_zone_name[network_min] = zone_name
+        i = bisect_right(network_mins, network_min)
+        network_mins = network_mins[:i] + (network_min,) + network_mins[i:]
+        zone_names = (zone_name,)
         now_default = True
+      ranges = dict(ranges)
+      ranges[network_min] = (network_max, zone_names)
+      zone_network_mins = dict(zone_network_mins)
+      zone_network_mins[zone_name] = zone_network_mins.get(zone_name, frozenset()) | {network_min}
       
-      logging.debug('%s adding network range %d-%d to zone %s%s', str(self._router), network_min, network_max,
-                    zone_name.decode('mac_roman', 'replace'), ' (now default zone for this range)' if now_default else '')
-      self._zone_name_to_network_min_set[zone_name].add(network_min)
+      # ZIP replies can add zones in bulk, so don't decode and format for a debug message that won't be logged
+      if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug('%s adding network range %d-%d to zone %s%s', str(self._router), network_min, network_max,
+                      zone_name.decode('mac_roman', 'replace'), ' (now default zone for this range)' if now_default else '')
+      self._tables = (network_mins, ranges, zone_network_mins, zone_names_by_ucased)
+      self.version += 1
   
   def remove_networks(self, network_min, network_max=None):
     '''Remove a range of networks from all zones, removing associated zones if now empty of networks.'''
     if network_max and network_max < network_min: raise ValueError('range %d-%d is backwards' % (network_min, network_max))
     with self._lock:
-      network_max = self._check_range(network_min, network_max)
+      network_max = self._check_range(self._tables, network_min, network_max)
       if not network_max: return
       logging.debug('%s removing network range %d-%d from all zones', str(self._router), network_min, network_max)
-      for zone_name in self._network_min_to_zone_name_set[network_min]:
-        s = self._zone_name_to_network_min_set[zone_name]
-        s.remove(network_min)
-        if not s:
+      network_mins, ranges, zone_network_mins, zone_names_by_ucased = self._tables
+      zone_network_mins = dict(zone_network_mins)
+      zone_names_by_ucased = dict(zone_names_by_ucased)
+      for zone_name in ranges[network_min][1]:
+        s = zone_network_mins[zone_name] - {network_min}
+        if s:
+          zone_network_mins[zone_name] = s
+        else:
           logging.debug('%s removing zone %s because it no longer contains any networks', str(self._router),
                         zone_name.decode('mac_roman', 'replace'))
-          self._zone_name_to_network_min_set.pop(zone_name)
-          self._ucased_zone_name_to_zone_name.pop(ucase(zone_name))
-      self._network_min_to_default_zone_name.pop(network_min)
-      self._network_min_to_zone_name_set.pop(network_min)
-      self._network_min_to_network_max.pop(network_min)
+          zone_network_mins.pop(zone_name)
+          zone_names_by_ucased.pop(self._zone_name_to_ucased_zone_name.pop(zone_name))
+      ranges = dict(ranges)
+      ranges.pop(network_min)
+      i = bisect_left(network_mins, network_min)
+      self._tables = (network_mins[:i] + network_mins[i + 1:], ranges, zone_network_mins, zone_names_by_ucased)
+      self.version += 1
   
   def zones(self):
-    '''Return the zones in this ZIT.'''
-    with self._lock:
-      return list(self._zone_name_to_network_min_set.keys())
+    '''Return a tuple containing the names of the zones in this ZIT.'''
+    return tuple(self._tables[2])
+  
+  def get_zone_name(self, zone_name):
+    '''Return the name of the zone in this ZIT that matches the given zone name case-insensitively, or None if there is none.'''
+    return self._tables[3].get(self._ucase(zone_name))
   
   def zones_in_network_range(self, network_min, network_max=None):
-    '''Return a deque containing the names of all zones in the given range of networks, default zone name first.'''
+    '''Return a tuple containing the names of all zones in the given range of networks, default zone name first.'''
     if network_max and network_max < network_min: raise ValueError('range %d-%d is backwards' % (network_min, network_max))
-    with self._lock:
-      if not self._check_range(network_min, network_max): return deque()
-      default_zone_name = self._network_min_to_default_zone_name[network_min]
-      retval = deque(zone_name for zone_name in self._network_min_to_zone_name_set[network_min] if zone_name != default_zone_name)
-      retval.appendleft(default_zone_name)
-    return retval
+    tables = self._tables
+    if not self._check_range(tables, network_min, network_max): return ()
+    return tables[1][network_min][1]
+  
+  def zones_in_network(self, network):
+    '''Return a tuple containing the names of all zones in the network range that contains the given network, default zone name
+    first.'''
+    network_mins, ranges, _, _ = self._tables
+    i = bisect_right(network_mins, network) - 1
+    if i < 0: return ()
+    network_max, zone_names = ranges[network_mins[i]]
+    return () if network_max < network else zone_names
   
   def networks_in_zone(self, zone_name):
-    '''Return a deque containing the network numbers of all networks in the given zone.'''
-    with self._lock:
-      zone_name = self._ucased_zone_name_to_zone_name.get(ucase(zone_name))
-      if zone_name is None: return deque()
-      retval = deque()
-      for network_min in self._zone_name_to_network_min_set[zone_name]:
-        retval.extend(range(network_min, self._network_min_to_network_max[network_min] + 1))
-    return retval
+    '''Return a tuple containing the network numbers of all networks in the given zone.'''
+    _, ranges, zone_network_mins, zone_names_by_ucased = self._tables
+    zone_name = zone_names_by_ucased.get(self._ucase(zone_name))
+    if zone_name is None: return ()
+    return tuple(chain.from_iterable(range(network_min, ranges[network_min][0] + 1) for network_min in zone_network_mins[zone_name]))
+  
+  def network_ranges_in_zone(self, zone_name):
+    '''Return a tuple containing (network_min, network_max) of all network ranges in the given zone.'''
+    _, ranges, zone_network_mins, zone_names_by_ucased = self._tables
+    zone_name = zone_names_by_ucased.get(self._ucase(zone_name))
+    if zone_name is None: return ()
+    return tuple((network_min, ranges[network_min][0]) for network_min in zone_network_mins[zone_name])
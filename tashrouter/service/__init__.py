@@ -4,7 +4,9 @@
 class Service:
   '''A service that lives on a router and sends/receives on a static socket.
   
-  This class does not extend Thread because it may have multiple threads according to the implementer's design.
+  This class does not extend Thread because it may have multiple threads according to the implementer's design.  It may also have
+  none at all: inbound is called on the thread of the Port that received the Datagram, so a Service whose handling is quick and
+  never blocks (such as EchoService) can do it right there, in which case start and stop need only connect and disconnect it.
   '''
   
   def start(self, router):
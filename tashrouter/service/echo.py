@@ -1,7 +1,6 @@
 '''Echo service.'''
 
-from queue import Queue
-from threading import Thread, Event
+import logging
 
 from . import Service
 
@@ -16,32 +15,23 @@ class EchoService(Service):
   ECHO_FUNC_REPLY_BYTE = b'\x02'
   
   def __init__(self):
-    self.thread = None
-    self.queue = Queue()
-    self.stop_flag = object()
-    self.started_event = Event()
-    self.stopped_event = Event()
+    self._router = None
   
   def start(self, router):
-    self.thread = Thread(target=self._run, args=(router,))
-    self.thread.start()
-    self.started_event.wait()
+    self._router = router
   
   def stop(self):
-    self.queue.put(self.stop_flag)
-    self.stopped_event.wait()
-  
-  def _run(self, router):
-    self.started_event.set()
-    while True:
-      item = self.queue.get()
-      if item is self.stop_flag: break
-      datagram, rx_port = item
-      if datagram.ddp_type != self.ECHO_DDP_TYPE: continue
-      if not datagram.data: continue
-      if datagram.data[0:1] != self.ECHO_FUNC_REQUEST_BYTE: continue
-      router.reply(datagram, rx_port, self.ECHO_DDP_TYPE, self.ECHO_FUNC_REPLY_BYTE + datagram.data[1:])
-    self.stopped_event.set()
+    self._router = None
   
   def inbound(self, datagram, rx_port):
-    self.queue.put((datagram, rx_port))
+    # replying is quick and never blocks, so it's done right here on the Port's thread rather than handed off to one of our own
+    router = self._router
+    if router is None: return
+    if datagram.ddp_type != self.ECHO_DDP_TYPE: return
+    data = datagram.data
+    if data[0:1] != self.ECHO_FUNC_REQUEST_BYTE: return
+    try:
+      # concatenating a memoryview copies the echoed payload once rather than slicing it and then copying the slice
+      router.reply(datagram, rx_port, self.ECHO_DDP_TYPE, self.ECHO_FUNC_REPLY_BYTE + memoryview(data)[1:])
+    except ValueError as e:  # a request that can't be replied to must not bring down the Port that received it
+      logging.warning("%s couldn't reply to echo request: %s", router, e.args[0])
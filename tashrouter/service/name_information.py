@@ -1,11 +1,17 @@
 '''Name Information Service.'''
 
-from queue import Queue
+from functools import partial
+from queue import SimpleQueue
 import struct
 from threading import Thread, Event
 
 from . import Service
 from ..datagram import Datagram
+from ..router.versioned_cache import VersionedCache
+
+
+# function and tuple count, NBP ID, then the first tuple's network, node, socket, enumerator, and object field length
+NBP_HEADER = struct.Struct('>BBHBBBB')
 
 
 class NameInformationService(Service):
@@ -19,14 +25,45 @@ class NameInformationService(Service):
   NBP_CTRL_LKUP_REPLY = 3
   NBP_CTRL_FWDREQ = 4
   
+  NBP_HANDLED_FUNC_TUPLE_COUNTS = frozenset(((NBP_CTRL_BRRQ << 4) | 1, (NBP_CTRL_FWDREQ << 4) | 1))  # only single-tuple ones
+  
   MAX_FIELD_LEN = 32
   
+  ZONE_CACHE_SIZE = 128
+  
+  # LkUps always go out to every node on a network from our NBP socket, so only the source address and data vary between them
+  _lkup_datagram = partial(Datagram, hop_count=0, destination_network=0x0000, destination_node=0xFF, destination_socket=NBP_SAS,
+                           source_socket=NBP_SAS, ddp_type=NBP_DDP_TYPE)
+  
   def __init__(self):
     self.thread = None
-    self.queue = Queue()
+    self.queue = SimpleQueue()
     self.stop_flag = object()
     self.started_event = Event()
     self.stopped_event = Event()
+    self._zone_cache = VersionedCache(self.ZONE_CACHE_SIZE)  # zone name -> routing table entries, keyed on RT and ZIT versions
+  
+  @staticmethod
+  def _find_entries_in_zone(router, zone_name):
+    '''Return the routing table entries for the networks in a zone.'''
+    get_by_network = router.routing_table.get_by_network
+    entries = {}
+    for network_min, network_max in router.zone_information_table.network_ranges_in_zone(zone_name):
+      network = network_min
+      while network <= network_max:
+        entry, _ = get_by_network(network)
+        if entry is None:
+          network += 1
+        else:  # an entry covers its whole range, so there's no need to look up the rest of the networks in it
+          entries[entry] = None
+          network = entry.network_max + 1
+    return tuple(entries)
+  
+  def _entries_in_zone(self, router, zone_name):
+    '''Return the routing table entries for the networks in a zone, caching them for as long as the RoutingTable and the ZIT
+    stay unchanged.'''
+    version = (router.routing_table.version, router.zone_information_table.version)
+    return self._zone_cache.get(version, zone_name, partial(self._find_entries_in_zone, router))
   
   def start(self, router):
     self.thread = Thread(target=self._run, args=(router,))
@@ -47,32 +84,32 @@ class NameInformationService(Service):
       if item is self.stop_flag: break
       datagram, rx_port = item
       
-      if datagram.ddp_type != self.NBP_DDP_TYPE: continue
-      if len(datagram.data) < 12: continue
-      func_tuple_count, nbp_id, req_network, req_node, req_socket, _, object_field = struct.unpack('>BBHBBBB', datagram.data[:8])
-      func = func_tuple_count >> 4
-      tuple_count = func_tuple_count & 0xF
-      if tuple_count != 1 or func not in (self.NBP_CTRL_BRRQ, self.NBP_CTRL_FWDREQ): continue
-      if object_field < 1 or object_field > self.MAX_FIELD_LEN: continue
-      if len(datagram.data) < 8 + object_field: continue
-      type_field = datagram.data[8 + object_field]
-      if type_field < 1 or type_field > self.MAX_FIELD_LEN: continue
-      if len(datagram.data) < 9 + object_field + type_field: continue
-      zone_field = datagram.data[9 + object_field + type_field]
-      if zone_field > self.MAX_FIELD_LEN: continue
-      if len(datagram.data) < 10 + object_field + type_field + zone_field: continue
-      zone_field = datagram.data[10 + object_field + type_field:10 + object_field + type_field + zone_field] or b'*'
-      type_field = datagram.data[9 + object_field:9 + object_field + type_field]
-      object_field = datagram.data[8:8 + object_field]
+      data = datagram.data
+      if datagram.ddp_type != self.NBP_DDP_TYPE or len(data) < 12: continue
+      func_tuple_count, nbp_id, req_network, req_node, req_socket, _, object_length = NBP_HEADER.unpack_from(data)
+      if func_tuple_count not in self.NBP_HANDLED_FUNC_TUPLE_COUNTS: continue
       
-      common_data = b''.join((struct.pack('>BHBBBB', nbp_id, req_network, req_node, req_socket, 0, len(object_field)),
-                              object_field,
-                              struct.pack('>B', len(type_field)),
-                              type_field,
-                              struct.pack('>B', len(zone_field)),
-                              zone_field))
-      lkup_data = struct.pack('>B', (self.NBP_CTRL_LKUP << 4) | 1) + common_data
-      fwdreq_data = struct.pack('>B', (self.NBP_CTRL_FWDREQ << 4) | 1) + common_data
+      # object, type, and zone fields are each preceded by their length and follow each other with nothing in between; a length
+      # byte that falls off the end of the data can only come from a malformed request, so that is left to raise rather than checked
+      try:
+        type_length = data[NBP_HEADER.size + object_length]
+        zone_offset = NBP_HEADER.size + object_length + 1 + type_length
+        zone_length = data[zone_offset]
+      except IndexError:
+        continue
+      zone_end = zone_offset + 1 + zone_length
+      if not (1 <= object_length <= self.MAX_FIELD_LEN and 1 <= type_length <= self.MAX_FIELD_LEN and
+              zone_length <= self.MAX_FIELD_LEN and zone_end <= len(data)): continue
+      if zone_length:
+        zone_field = data[zone_offset + 1:zone_end]
+        tuple_data = data[NBP_HEADER.size:zone_end]
+      else:
+        zone_field = b'*'
+        tuple_data = data[NBP_HEADER.size:zone_offset] + b'\x01*'
+      
+      func = func_tuple_count >> 4
+      lkup_data = NBP_HEADER.pack((self.NBP_CTRL_LKUP << 4) | 1, nbp_id, req_network, req_node, req_socket, 0,
+                                  object_length) + tuple_data
       
       if func == self.NBP_CTRL_BRRQ:
         
@@ -80,42 +117,20 @@ class NameInformationService(Service):
         if zone_field == b'*':
           if rx_port.extended_network: continue  # BrRqs from extended networks must provide zone name
           if rx_port.network:
-            entry, _ = router.routing_table.get_by_network(rx_port.network)
-            if entry:
-              try:
-                zones = router.zone_information_table.zones_in_network_range(entry.network_min)
-              except ValueError:
-                pass
-              else:
-                if len(zones) == 1: zone_field = zones[0]  # there should not be more than one zone
+            zones = router.zone_information_table.zones_in_network(rx_port.network)
+            if len(zones) == 1: zone_field = zones[0]  # there should not be more than one zone
         
         # if zone is still *, just broadcast a LkUp on the requesting network and call it done
         if zone_field == b'*':
-          rx_port.broadcast(Datagram(hop_count=0,
-                                     destination_network=0x0000,
-                                     source_network=rx_port.network,
-                                     destination_node=0xFF,
-                                     source_node=rx_port.node,
-                                     destination_socket=self.NBP_SAS,
-                                     source_socket=self.NBP_SAS,
-                                     ddp_type=self.NBP_DDP_TYPE,
-                                     data=lkup_data))
+          rx_port.broadcast(self._lkup_datagram(source_network=rx_port.network, source_node=rx_port.node, data=lkup_data))
         # we know the zone, so multicast LkUps to directly-connected networks and send FwdReqs to non-directly-connected ones
         else:
-          entries = set(router.routing_table.get_by_network(network)
-                        for network in router.zone_information_table.networks_in_zone(zone_field))
-          entries.discard((None, None))
-          for entry, _ in entries:
+          fwdreq_data = NBP_HEADER.pack((self.NBP_CTRL_FWDREQ << 4) | 1, nbp_id, req_network, req_node, req_socket, 0,
+                                        object_length) + tuple_data
+          for entry in self._entries_in_zone(router, zone_field):
             if entry.distance == 0:
-              entry.port.multicast(zone_field, Datagram(hop_count=0,
-                                                        destination_network=0x0000,
-                                                        source_network=entry.port.network,
-                                                        destination_node=0xFF,
-                                                        source_node=entry.port.node,
-                                                        destination_socket=self.NBP_SAS,
-                                                        source_socket=self.NBP_SAS,
-                                                        ddp_type=self.NBP_DDP_TYPE,
-                                                        data=lkup_data))
+              entry.port.multicast(zone_field, self._lkup_datagram(source_network=entry.port.network, source_node=entry.port.node,
+                                                                   data=lkup_data))
             else:
               router.route(Datagram(hop_count=0,
                                     destination_network=entry.network_min,
@@ -131,15 +146,8 @@ class NameInformationService(Service):
         
         entry, _ = router.routing_table.get_by_network(datagram.destination_network)
         if entry is None or entry.distance != 0: continue  # FwdReq thinks we're directly connected to this network but we're not
-        entry.port.multicast(zone_field, Datagram(hop_count=0,
-                                                  destination_network=0x0000,
-                                                  source_network=entry.port.network,
-                                                  destination_node=0xFF,
-                                                  source_node=entry.port.node,
-                                                  destination_socket=self.NBP_SAS,
-                                                  source_socket=self.NBP_SAS,
-                                                  ddp_type=self.NBP_DDP_TYPE,
-                                                  data=lkup_data))
+        entry.port.multicast(zone_field, self._lkup_datagram(source_network=entry.port.network, source_node=entry.port.node,
+                                                             data=lkup_data))
     
     self.stopped_event.set()
   
@@ -1,12 +1,15 @@
 '''RTMP service mixin.'''
 
-from collections import deque
-from itertools import chain
 import struct
 
 from ...datagram import Datagram
 
 
+RTMP_HEADER = struct.Struct('>HBB')  # sender's network, node ID length in bits, sender's node
+RTMP_TUPLE = struct.Struct('>HB')  # network, distance
+RTMP_EXTENDED_TUPLE = struct.Struct('>HBHB')  # network range start, distance with high bit set, network range end, RTMP version
+
+
 class RtmpService:
   '''Mixin class that contains constants and common functions used by RTMP services.'''
   
@@ -20,40 +23,54 @@ class RtmpService:
   
   NOTIFY_NEIGHBOR = 31
   
+  # (RoutingTable version, (entry, binary tuple) for every entry in the RoutingTable) as of the last time tuples were built
+  _routing_table_tuples = (None, ())
+  
+  def _binary_tuples(self, router):
+    '''Return (entry, binary tuple) for every entry in the given Router's RoutingTable, packing them only when it has changed.'''
+    # the version is read before the entries, for the reason given in VersionedCache
+    version = router.routing_table.version
+    cache_version, binary_tuples = self._routing_table_tuples
+    if cache_version == version: return binary_tuples
+    retval = []
+    for entry, is_bad in router.routing_table.entries():
+      distance = self.NOTIFY_NEIGHBOR if is_bad else entry.distance
+      if not entry.extended_network:
+        retval.append((entry, RTMP_TUPLE.pack(entry.network_min, distance & 0x1F)))
+      else:
+        retval.append((entry, RTMP_EXTENDED_TUPLE.pack(entry.network_min, (distance & 0x1F) | 0x80, entry.network_max,
+                                                        self.RTMP_VERSION)))
+    binary_tuples = tuple(retval)
+    self._routing_table_tuples = (version, binary_tuples)
+    return binary_tuples
+  
   def make_routing_table_datagram_data(self, router, port, split_horizon=True):
     '''Build Datagram data for the given Router's RoutingTable.'''
     
-    if 0 in (port.network_min, port.network_max): return
+    # read the Port's attributes once rather than once per entry, which also keeps them consistent across the whole table
+    extended_network, network_min, network_max = port.extended_network, port.network_min, port.network_max
+    if 0 in (network_min, network_max): return
 
-    binary_tuples = deque()
+    binary_tuples = []
     this_net = None
-    for entry, is_bad in router.routing_table.entries():
-      distance = self.NOTIFY_NEIGHBOR if is_bad else entry.distance
-      if not entry.extended_network:
-        binary_tuple = struct.pack('>HB', entry.network_min, distance & 0x1F)
-      else:
-        binary_tuple = struct.pack('>HBHB', entry.network_min, (distance & 0x1F) | 0x80, entry.network_max, self.RTMP_VERSION)
-      if port.extended_network and port.network_min == entry.network_min and port.network_max == entry.network_max:
+    for entry, binary_tuple in self._binary_tuples(router):
+      if extended_network and network_min == entry.network_min and network_max == entry.network_max:
         this_net = binary_tuple
-      elif entry.port is port and split_horizon:
+      elif split_horizon and entry.port is port:
         pass  # split horizon
       else:
         binary_tuples.append(binary_tuple)
-    if port.extended_network and not this_net: raise ValueError("port's network range was not found in routing table")
+    if extended_network and not this_net: raise ValueError("port's network range was not found in routing table")
 
     if port.extended_network:
-      rtmp_datagram_header = struct.pack('>HBB', port.network, 8, port.node) + this_net
+      rtmp_datagram_header = RTMP_HEADER.pack(port.network, 8, port.node) + this_net
     else:
-      rtmp_datagram_header = struct.pack('>HBBHB', port.network, 8, port.node, 0, self.RTMP_VERSION)
-
-    next_datagram_data = deque((rtmp_datagram_header,))
-    next_datagram_data_length = len(rtmp_datagram_header)
-    for binary_tuple in chain(binary_tuples, (None,)):
-      if binary_tuple is None or next_datagram_data_length + len(binary_tuple) > Datagram.MAX_DATA_LENGTH:
-        yield b''.join(next_datagram_data)
-        if binary_tuple is not None:
-          next_datagram_data = deque((rtmp_datagram_header, binary_tuple))
-          next_datagram_data_length = len(rtmp_datagram_header) + len(binary_tuple)
-      else:
-        next_datagram_data.append(binary_tuple)
-        next_datagram_data_length += len(binary_tuple)
+      rtmp_datagram_header = RTMP_HEADER.pack(port.network, 8, port.node) + RTMP_TUPLE.pack(0, self.RTMP_VERSION)
+
+    datagram_data = bytearray(rtmp_datagram_header)
+    for binary_tuple in binary_tuples:
+      if len(datagram_data) + len(binary_tuple) > Datagram.MAX_DATA_LENGTH:
+        yield bytes(datagram_data)
+        datagram_data = bytearray(rtmp_datagram_header)
+      datagram_data += binary_tuple
+    yield bytes(datagram_data)
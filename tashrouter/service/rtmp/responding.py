@@ -1,11 +1,9 @@
 '''RTMP responding Service.'''
 
-from collections import deque
-from queue import Queue
-import struct
+from queue import SimpleQueue
 from threading import Thread, Event
 
-from . import RtmpService
+from . import RtmpService, RTMP_HEADER, RTMP_TUPLE, RTMP_EXTENDED_TUPLE
 from .. import Service
 from ...router.routing_table import RoutingTableEntry
 
@@ -15,9 +13,22 @@ class RtmpRespondingService(Service, RtmpService):
   
   def __init__(self):
     self.thread = None
-    self.started_event = Event()
-    self.queue = Queue()
+    self.queue = SimpleQueue()
     self.stop_flag = object()
+    self.started_event = Event()
+    self.stopped_event = Event()
+    self._response_data_by_port = {}  # Port -> ((network, node, network_min, network_max), RTMP response data)
+  
+  def _response_data(self, port):
+    '''Return the data for a response to an RTMP request on the given Port, packing it only when the Port's address changes.'''
+    address = (port.network, port.node, port.network_min, port.network_max)
+    cached_address, response_data = self._response_data_by_port.get(port, (None, None))
+    if cached_address != address:
+      response_data = RTMP_HEADER.pack(port.network, 8, port.node)
+      if port.extended_network:
+        response_data += RTMP_EXTENDED_TUPLE.pack(port.network_min, 0x80, port.network_max, self.RTMP_VERSION)
+      self._response_data_by_port[port] = (address, response_data)
+    return response_data
   
   def start(self, router):
     self.thread = Thread(target=self._run, args=(router,))
@@ -26,17 +37,14 @@ class RtmpRespondingService(Service, RtmpService):
   
   def stop(self):
     self.queue.put(self.stop_flag)
-    self.queue.join()
+    self.stopped_event.wait()
   
   def _run(self, router):
     
+    self.started_event.set()
+    
     while True:
       
-      if self.started_event.is_set():
-        self.queue.task_done()
-      else:
-        self.started_event.set()
-      
       item = self.queue.get()
       if item is self.stop_flag: break
       datagram, rx_port = item
@@ -44,41 +52,45 @@ class RtmpRespondingService(Service, RtmpService):
       if datagram.ddp_type == self.RTMP_DDP_TYPE_DATA:
         
         # process header
-        if len(datagram.data) < 4: continue  # invalid, datagram too short
-        sender_network, id_length, sender_node = struct.unpack('>HBB', datagram.data[0:4])
+        data = datagram.data
+        if len(data) < 4: continue  # invalid, datagram too short
+        sender_network, id_length, sender_node = RTMP_HEADER.unpack_from(data)
         if id_length != 8: continue  # invalid, AppleTalk node numbers are only 8 bits in length
-        data = datagram.data[4:]
         if rx_port.extended_network:
-          if len(data) < 6: continue  # invalid, datagram too short to contain at least one extended network tuple
-          sender_network_min, range_distance, sender_network_max, rtmp_version = struct.unpack('>HBHB', data[0:6])
+          if len(data) < 10: continue  # invalid, datagram too short to contain at least one extended network tuple
+          sender_network_min, range_distance, sender_network_max, rtmp_version = RTMP_EXTENDED_TUPLE.unpack_from(data, 4)
           if range_distance != 0x80: continue  # invalid, first tuple must be the sender's extended network tuple
+          data_idx = 4
         else:
-          if len(data) < 3: continue
+          if len(data) < 7: continue
           sender_network_min = sender_network_max = sender_network
-          zero, rtmp_version = struct.unpack('>HB', data[0:3])
+          zero, rtmp_version = RTMP_TUPLE.unpack_from(data, 4)
           if zero != 0: continue  # invalid, this word must be zero on a nonextended network
-          data = data[3:]
+          data_idx = 7
         if rtmp_version != self.RTMP_VERSION: continue  # invalid, don't recognize this RTMP format
         
-        # interpret tuples
-        tuples = deque()
-        data_idx = 0
-        while True:
-          packed = data[data_idx:data_idx + 3]
-          if len(packed) != 3: break
-          network_min, range_distance = struct.unpack('>HB', packed)
-          if range_distance & 0x80:
-            extended_network = True
-            packed = data[data_idx + 3:data_idx + 6]
-            if len(packed) != 3: break
-            network_max, _ = struct.unpack('>HB', packed)
-            data_idx += 6
-          else:
-            extended_network = False
-            network_max = network_min
-            data_idx += 3
-          tuples.append((extended_network, network_min, network_max, range_distance & 0x1F))
-        if data_idx != len(data): continue  # invalid, tuples did not end where expected
+        # interpret tuples; if none is extended, every third byte is a distance without the high bit set, and they can all be
+        # unpacked in one go rather than walked one at a time (this is always the case for tuples from nonextended networks)
+        data_len = len(data)
+        tuple_data = data[data_idx:]
+        if (data_len - data_idx) % 3 == 0 and max(tuple_data[2::3], default=0) < 0x80:
+          tuples = [(False, network_min, network_min, range_distance & 0x1F)
+                    for network_min, range_distance in RTMP_TUPLE.iter_unpack(tuple_data)]
+        else:
+          tuples = []
+          while data_idx + 3 <= data_len:
+            network_min, range_distance = RTMP_TUPLE.unpack_from(data, data_idx)
+            if range_distance & 0x80:
+              if data_idx + 6 > data_len: break
+              extended_network = True
+              network_max, _ = RTMP_TUPLE.unpack_from(data, data_idx + 3)
+              data_idx += 6
+            else:
+              extended_network = False
+              network_max = network_min
+              data_idx += 3
+            tuples.append((extended_network, network_min, network_max, range_distance & 0x1F))
+          if data_idx != data_len: continue  # invalid, tuples did not end where expected
         
         # if this Port doesn't know its network range yet, accept that this is from the network's seed router
         if rx_port.network_min == rx_port.network_max == 0: rx_port.set_network_range(sender_network_min, sender_network_max)
@@ -106,10 +118,7 @@ class RtmpRespondingService(Service, RtmpService):
         
         if 0 in (rx_port.network_min, rx_port.network_max): continue
         if datagram.hop_count != 0: continue  # we have to send responses out of the same port they came in, no routing
-        response_data = struct.pack('>HBB', rx_port.network, 8, rx_port.node)
-        if rx_port.extended_network:
-          response_data += struct.pack('>HBHB', rx_port.network_min, 0x80, rx_port.network_max, self.RTMP_VERSION)
-        router.reply(datagram, rx_port, self.RTMP_DDP_TYPE_DATA, response_data)
+        router.reply(datagram, rx_port, self.RTMP_DDP_TYPE_DATA, self._response_data(rx_port))
         
       elif datagram.data[0] in (self.RTMP_FUNC_RDR_SPLIT_HORIZON, self.RTMP_FUNC_RDR_NO_SPLIT_HORIZON):
         
@@ -117,7 +126,7 @@ class RtmpRespondingService(Service, RtmpService):
         for datagram_data in self.make_routing_table_datagram_data(router, rx_port, split_horizon):
           router.reply(datagram, rx_port, self.RTMP_DDP_TYPE_DATA, datagram_data)
     
-    self.queue.task_done()
+    self.stopped_event.set()
   
   def inbound(self, datagram, rx_port):
     self.queue.put((datagram, rx_port))
@@ -34,24 +34,31 @@ class RtmpSendingService(Service, RtmpService):
     self.started_event.set()
     while True:
       try:
-        item = self.queue.get(timeout=self.timeout)
+        items = [self.queue.get(timeout=self.timeout)]
       except Empty:
-        item = None
-      if item is self.stop_flag: break
-      for port in router.ports:
-        if 0 in (port.node, port.network): continue
-        for datagram_data in self.make_routing_table_datagram_data(router, port):
-          port.broadcast(Datagram(hop_count=0,
-                                  destination_network=0x0000,
-                                  source_network=port.network,
-                                  destination_node=0xFF,
-                                  source_node=port.node,
-                                  destination_socket=self.RTMP_SAS,
-                                  source_socket=self.RTMP_SAS,
-                                  ddp_type=self.RTMP_DDP_TYPE_DATA,
-                                  data=datagram_data))
-      if item is not None: self.queue.task_done()
-    self.queue.task_done()
+        items = []
+      # drain whatever else is queued, so a burst of force_sends is answered with one send rather than one per force_send
+      while True:
+        try:
+          items.append(self.queue.get_nowait())
+        except Empty:
+          break
+      stopping = self.stop_flag in items
+      if not stopping or len(items) > 1:
+        for port in router.ports:
+          if 0 in (port.node, port.network): continue
+          for datagram_data in self.make_routing_table_datagram_data(router, port):
+            port.broadcast(Datagram(hop_count=0,
+                                    destination_network=0x0000,
+                                    source_network=port.network,
+                                    destination_node=0xFF,
+                                    source_node=port.node,
+                                    destination_socket=self.RTMP_SAS,
+                                    source_socket=self.RTMP_SAS,
+                                    ddp_type=self.RTMP_DDP_TYPE_DATA,
+                                    data=datagram_data))
+      for _ in items: self.queue.task_done()
+      if stopping: break
   
   def inbound(self, datagram, rx_port):
     pass
@@ -1,5 +1,15 @@
 '''Mixin containing constants used by services that use ZIP (Zone Information Protocol).'''
 
+import struct
+
+
+ZIP_HEADER = struct.Struct('>BB')  # function, network or zone count
+ZIP_NETWORK = struct.Struct('>H')
+ZIP_ZONE_LIST_ITEM_HEADER = struct.Struct('>HB')  # network, zone name length
+ZIP_GETNETINFO_REPLY_HEADER = struct.Struct('>BBHHB')  # function, flags, network range start and end, given zone name length
+ATP_HEADER = struct.Struct('>BBHBBH')  # control, bitmap or sequence number, TID, and four user bytes as ZIP uses them
+
+
 class ZipService:
   '''Mixin containing constants used by services that use ZIP (Zone Information Protocol).'''
   
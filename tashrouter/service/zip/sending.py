@@ -1,12 +1,10 @@
 '''ZIP (Zone Information Protocol) sending service.'''
 
-from collections import deque
-from itertools import chain
 import logging
 import struct
 from threading import Thread, Event
 
-from . import ZipService
+from . import ZipService, ZIP_HEADER, ZIP_NETWORK
 from .. import Service
 from ...datagram import Datagram
 
@@ -15,6 +13,7 @@ class ZipSendingService(Service, ZipService):
   '''A Service which sends ZIP queries to fill out its router's Zone Information Table.'''
   
   DEFAULT_TIMEOUT = 10  # seconds
+  MAX_QUERY_NETWORKS = min(255, (Datagram.MAX_DATA_LENGTH - ZIP_HEADER.size) // ZIP_NETWORK.size)  # network count is one byte
   
   def __init__(self, timeout=DEFAULT_TIMEOUT):
     self.timeout = timeout
@@ -41,9 +40,10 @@ class ZipSendingService(Service, ZipService):
       if self.stop_requested_event.wait(timeout=self.timeout): break
       
       queries = {}  # (port, network, node) -> network_mins
+      zones_in_network_range = router.zone_information_table.zones_in_network_range
       for entry in router.routing_table:
         try:
-          if next(iter(router.zone_information_table.zones_in_network_range(entry.network_min, entry.network_max)), None): continue
+          if zones_in_network_range(entry.network_min, entry.network_max): continue
         except ValueError as e:
           logging.warning('%s apparent disjoin between routing table and zone information table: %s', router, e.args[0])
           continue
@@ -51,39 +51,27 @@ class ZipSendingService(Service, ZipService):
           key = (entry.port, 0x0000, 0xFF)
         else:
           key = (entry.port, entry.next_network, entry.next_node)
-        if key not in queries: queries[key] = deque()
-        queries[key].append(entry.network_min)
+        queries.setdefault(key, []).append(entry.network_min)
       
       for port_network_node, network_mins in queries.items():
         port, network, node = port_network_node
         if 0 in (port.node, port.network): continue
-        datagram_data = deque()
-        for network_min in chain(network_mins, (None,)):
-          if network_min is None or len(datagram_data) * 2 + 4 > Datagram.MAX_DATA_LENGTH:
-            datagram_data.appendleft(struct.pack('>BB', self.ZIP_FUNC_QUERY, len(datagram_data)))
-            if (network, node) == (0x0000, 0xFF):
-              port.broadcast(Datagram(hop_count=0,
-                                      destination_network=network,
-                                      source_network=port.network,
-                                      destination_node=node,
-                                      source_node=port.node,
-                                      destination_socket=self.ZIP_SAS,
-                                      source_socket=self.ZIP_SAS,
-                                      ddp_type=self.ZIP_DDP_TYPE,
-                                      data=b''.join(datagram_data)))
-            else:
-              port.unicast(network, node, Datagram(hop_count=0,
-                                                   destination_network=network,
-                                                   source_network=port.network,
-                                                   destination_node=node,
-                                                   source_node=port.node,
-                                                   destination_socket=self.ZIP_SAS,
-                                                   source_socket=self.ZIP_SAS,
-                                                   ddp_type=self.ZIP_DDP_TYPE,
-                                                   data=b''.join(datagram_data)))
-            if network_min is not None: datagram_data = deque((struct.pack('>H', network_min),))
+        for i in range(0, len(network_mins), self.MAX_QUERY_NETWORKS):
+          query_network_mins = network_mins[i:i + self.MAX_QUERY_NETWORKS]
+          datagram = Datagram(hop_count=0,
+                              destination_network=network,
+                              source_network=port.network,
+                              destination_node=node,
+                              source_node=port.node,
+                              destination_socket=self.ZIP_SAS,
+                              source_socket=self.ZIP_SAS,
+                              ddp_type=self.ZIP_DDP_TYPE,
+                              data=ZIP_HEADER.pack(self.ZIP_FUNC_QUERY, len(query_network_mins)) +
+                                   struct.pack('>%dH' % len(query_network_mins), *query_network_mins))
+          if (network, node) == (0x0000, 0xFF):
+            port.broadcast(datagram)
           else:
-            datagram_data.append(struct.pack('>H', network_min))
+            port.unicast(network, node, datagram)
       
     self.stopped_event.set()
   